@@ -15,6 +15,7 @@ from test_framework.test_framework import (ComparisonTestFramework, DISABLE_FINA
 from test_framework.util import *
 from test_framework.comptool import TestManager, TestInstance, RejectResult
 from test_framework.blocktools import *
+import copy
 import time
 from test_framework.keytools import KeyTool
 from test_framework.script import *
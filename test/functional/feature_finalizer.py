@@ -16,16 +16,16 @@ from test_framework.util import (
 )
 
 
-def generate_block(node):
-    node.generatetoaddress(1, node.getnewaddress('', 'bech32'))
-
-
 class FeatureFinalizerTest(UnitETestFramework):
     def set_test_params(self):
         self.num_nodes = 2
+        # v votes at the first block of epoch 6 and the vote is included
+        # in the second one, so 3 blocks per epoch are enough
+        self.epoch_length = 3
+        esperanza_config = '-esperanzaconfig={"epochLength": %d, "minDepositSize": 1500}' % self.epoch_length
         self.extra_args = [
-            ['-esperanzaconfig={"epochLength": 5, "minDepositSize": 1500}'],
-            ['-esperanzaconfig={"epochLength": 5, "minDepositSize": 1500}', '-validating=1'],
+            [esperanza_config],
+            [esperanza_config, '-validating=1'],
         ]
         self.setup_clean_chain = True
 
@@ -39,21 +39,22 @@ class FeatureFinalizerTest(UnitETestFramework):
         p, v = self.nodes
         self.setup_stake_coins(p, v)
         self.generate_sync(p)
+        p.new_address = p.getnewaddress('', 'bech32')
 
         self.log.info("Setup deposit")
         v.new_address = v.getnewaddress("", "legacy")
         tx = v.deposit(v.new_address, 1500)
         self.wait_for_transaction(tx)
-        p.generatetoaddress(1, p.getnewaddress('', 'bech32'))
+        p.generatetoaddress(1, p.new_address)
         sync_blocks([p, v])
 
         self.log.info("Restart validator")
         self.restart_node(v.index)
 
         self.log.info("Leave insta justification")
-        for _ in range(24):
-            generate_block(p)
-        assert_equal(p.getblockcount(), 26)
+        # move from height 2 to the first block of epoch 6
+        p.generatetoaddress(5 * self.epoch_length - 1, p.new_address)
+        assert_equal(p.getblockcount(), 5 * self.epoch_length + 1)
         assert_finalizationstate(p, {"currentEpoch": 6,
                                      "lastJustifiedEpoch": 4,
                                      "lastFinalizedEpoch": 3,
@@ -61,9 +62,9 @@ class FeatureFinalizerTest(UnitETestFramework):
 
         self.log.info("Check finalizer votes after restart")
         self.wait_for_vote_and_disconnect(finalizer=v, node=p)
-        generate_block(p)
+        p.generatetoaddress(1, p.new_address)
 
-        assert_equal(p.getblockcount(), 27)
+        assert_equal(p.getblockcount(), 5 * self.epoch_length + 2)
         assert_finalizationstate(p, {"currentEpoch": 6,
                                      "lastJustifiedEpoch": 5,
                                      "lastFinalizedEpoch": 4,
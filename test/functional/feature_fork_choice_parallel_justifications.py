@@ -11,9 +11,13 @@ The following checks are performed:
 3. node doesn't re-org before finalization
 """
 
+from concurrent.futures import ThreadPoolExecutor
+import threading
+
 from test_framework.test_framework import UnitETestFramework
 from test_framework.mininode import (
     P2PInterface,
+    mininode_lock,
     network_thread_start,
     msg_witness_block,
 )
@@ -24,10 +28,8 @@ from test_framework.util import (
     disconnect_nodes,
     assert_equal,
     sync_blocks,
-    wait_until,
 )
 from test_framework.messages import (
-    CTransaction,
     CBlock,
     FromHex,
 )
@@ -37,16 +39,18 @@ from test_framework.regtest_mnemonics import regtest_mnemonics
 class BaseNode(P2PInterface):
     def __init__(self):
         super().__init__()
-        self.rejects = []
+        self.reject_events = {}
 
     def on_reject(self, msg):
-        self.rejects.append(msg)
+        self.reject_event(msg.reason, msg.data).set()
+
+    def reject_event(self, err, block):
+        with mininode_lock:
+            return self.reject_events.setdefault((err, block), threading.Event())
 
-    def has_reject(self, err, block):
-        for r in self.rejects:
-            if r.reason == err and r.data == block:
-                return True
-        return False
+    def wait_for_reject(self, err, block, timeout=5):
+        assert self.reject_event(err, block).wait(timeout), \
+            'reject %s for block %064x was not received' % (err, block)
 
 
 class ForkChoiceParallelJustificationsTest(UnitETestFramework):
@@ -54,7 +58,10 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         self.num_nodes = 5
         self.setup_clean_chain = True
 
-        esperanza_config = '-esperanzaconfig={"epochLength":5}'
+        # every justification below is included in the second or third
+        # block of its epoch, see height(epoch, block_number) in run_test
+        self.epoch_length = 3
+        esperanza_config = '-esperanzaconfig={"epochLength":%d}' % self.epoch_length
         self.extra_args = [
             ['-proposing=0', esperanza_config],
             ['-proposing=0', esperanza_config],
@@ -67,22 +74,23 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         self.setup_nodes()
 
     def run_test(self):
+        def height(epoch, block_number):
+            # height of the block_number-th block (starting from 1) of the epoch
+            return (epoch - 1) * self.epoch_length + block_number
+
         def create_justification(fork, finalizer, after_blocks):
-            fork.generatetoaddress(after_blocks - 1, fork.getnewaddress('', 'bech32'))
+            fork.generatetoaddress(after_blocks - 1, fork.new_address)
             self.wait_for_vote_and_disconnect(finalizer=finalizer, node=fork)
-            fork.generatetoaddress(1, fork.getnewaddress('', 'bech32'))
+            fork.generatetoaddress(1, fork.new_address)
             assert_equal(len(fork.getrawmempool()), 0)
 
         def sync_node_to_fork(node, fork):
             connect_nodes(node, fork.index)
-            block_hash = fork.getblockhash(fork.getblockcount())
+            block_hash = fork.getbestblockhash()
             node.waitforblock(block_hash, 5000)
-            assert_equal(node.getblockhash(node.getblockcount()), block_hash)
+            assert_equal(node.getbestblockhash(), block_hash)
             disconnect_nodes(node, fork.index)
 
-        def wait_for_reject(p2p, err, block):
-            wait_until(lambda: p2p.has_reject(err, block), timeout=5)
-
         # Two validators (but actually having the same key) produce parallel justifications
         # node must always follow the longest justified fork
         # finalizer1 -> fork1
@@ -96,11 +104,22 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         finalizer1 = self.nodes[3]
         finalizer2 = self.nodes[4]
 
-        node.importmasterkey(regtest_mnemonics[0]['mnemonics'])
-        finalizer1.importmasterkey(regtest_mnemonics[1]['mnemonics'])
-        finalizer2.importmasterkey(regtest_mnemonics[1]['mnemonics'])
-        fork1.importmasterkey(regtest_mnemonics[2]['mnemonics'])
-        fork2.importmasterkey(regtest_mnemonics[2]['mnemonics'])
+        # wallets of different nodes are independent, import the keys
+        # concurrently to not wait for each rescan one after another
+        wallet_keys = [
+            (node, regtest_mnemonics[0]['mnemonics']),
+            (finalizer1, regtest_mnemonics[1]['mnemonics']),
+            (finalizer2, regtest_mnemonics[1]['mnemonics']),
+            (fork1, regtest_mnemonics[2]['mnemonics']),
+            (fork2, regtest_mnemonics[2]['mnemonics']),
+        ]
+        with ThreadPoolExecutor(max_workers=len(wallet_keys)) as executor:
+            # consume the results to re-raise errors from the workers
+            list(executor.map(lambda k: k[0].importmasterkey(k[1]), wallet_keys))
+
+        node.new_address = node.getnewaddress('', 'bech32')
+        fork1.new_address = fork1.getnewaddress('', 'bech32')
+        fork2.new_address = fork2.getnewaddress('', 'bech32')
 
         # create network topology
         connect_nodes(node, fork1.index)
@@ -109,52 +128,35 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         connect_nodes(finalizer2, fork2.index)
 
         # leave IBD
-        node.generatetoaddress(2, node.getnewaddress('', 'bech32'))
+        node.generatetoaddress(2, node.new_address)
         sync_blocks([node, fork1, fork2, finalizer1, finalizer2])
 
-        # Do not let finalizer2 to see deposit from finalizer1
-        disconnect_nodes(node, fork2.index)
-
+        # finalizer2 shares the key of finalizer1, so instead of creating
+        # and signing the same deposit again it gets the deposit directly
         payto = finalizer1.getnewaddress('', 'legacy')
         txid1 = finalizer1.deposit(payto, 1500)
-        finalizer2.setaccount(payto, '')
-        txid2 = finalizer2.deposit(payto, 1500)
-        if txid1 != txid2:  # improve log message
-            tx1 = FromHex(CTransaction(), finalizer1.getrawtransaction(txid1))
-            tx2 = FromHex(CTransaction(), finalizer2.getrawtransaction(txid2))
-            print(tx1)
-            print(tx2)
-            assert_equal(txid1, txid2)
-
-        # Connect back
-        connect_nodes(node, fork2.index)
+        finalizer2.sendrawtransaction(finalizer1.getrawtransaction(txid1))
 
         self.wait_for_transaction(txid1, timeout=150)
 
-        node.generatetoaddress(1, node.getnewaddress('', 'bech32'))
-        sync_blocks([node, fork1, fork2])
-
-        disconnect_nodes(node, fork1.index)
-        disconnect_nodes(node, fork2.index)
         disconnect_nodes(finalizer1, fork1.index)
         disconnect_nodes(finalizer2, fork2.index)
 
-        # create common 5 epochs to leave instant finalization
+        # create common 5 epochs to leave instant finalization,
+        # fork1 and fork2 stay connected to node and follow it
         #                             fork1
         # F    F    F    F    J      /
         # e0 - e1 - e2 - e3 - e4 - e5 node
         #                            \
         #                             fork2
-        node.generatetoaddress(22, node.getnewaddress('', 'bech32'))
-        assert_equal(node.getblockcount(), 25)
+        node.generatetoaddress(height(5, self.epoch_length) - 2, node.new_address)
+        assert_equal(node.getblockcount(), height(5, self.epoch_length))
         assert_finalizationstate(node, {'currentDynasty': 2,
                                         'currentEpoch': 5,
                                         'lastJustifiedEpoch': 4,
                                         'lastFinalizedEpoch': 3,
                                         'validators': 0})
 
-        connect_nodes(node, fork1.index)
-        connect_nodes(node, fork2.index)
         sync_blocks([node, fork1, fork2])
         disconnect_nodes(node, fork1.index)
         disconnect_nodes(node, fork2.index)
@@ -169,8 +171,9 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         #                             fork2
         # e4 is finalized for fork1
         # e5 is justified for fork1
-        create_justification(fork=fork1, finalizer=finalizer1, after_blocks=2)
-        assert_equal(fork1.getblockcount(), 27)
+        create_justification(fork=fork1, finalizer=finalizer1,
+                             after_blocks=height(6, 2) - height(5, self.epoch_length))
+        assert_equal(fork1.getblockcount(), height(6, 2))
         assert_finalizationstate(fork1, {'currentDynasty': 3,
                                          'currentEpoch': 6,
                                          'lastJustifiedEpoch': 5,
@@ -195,16 +198,18 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         # e0 - e1 - e2 - e3 - e4 - e5
         #                            \       J
         #                             - e6 - e7 - e8 fork2, node
-        create_justification(fork=fork2, finalizer=finalizer2, after_blocks=2)
-        assert_equal(fork2.getblockcount(), 27)
+        create_justification(fork=fork2, finalizer=finalizer2,
+                             after_blocks=height(6, 2) - height(5, self.epoch_length))
+        assert_equal(fork2.getblockcount(), height(6, 2))
         assert_finalizationstate(fork2, {'currentDynasty': 3,
                                          'currentEpoch': 6,
                                          'lastJustifiedEpoch': 5,
                                          'lastFinalizedEpoch': 4,
                                          'validators': 1})
 
-        create_justification(fork=fork2, finalizer=finalizer2, after_blocks=10)
-        assert_equal(fork2.getblockcount(), 37)
+        create_justification(fork=fork2, finalizer=finalizer2,
+                             after_blocks=height(8, 2) - height(6, 2))
+        assert_equal(fork2.getblockcount(), height(8, 2))
         assert_finalizationstate(fork2, {'currentDynasty': 4,
                                          'currentEpoch': 8,
                                          'lastJustifiedEpoch': 7,
@@ -229,8 +234,9 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         # e0 - e1 - e2 - e3 - e4 - e5
         #                            \       J
         #                             - e6 - e7 - e8 fork2
-        create_justification(fork=fork1, finalizer=finalizer1, after_blocks=16)
-        assert_equal(fork1.getblockcount(), 43)
+        create_justification(fork=fork1, finalizer=finalizer1,
+                             after_blocks=height(9, 3) - height(6, 2))
+        assert_equal(fork1.getblockcount(), height(9, 3))
         assert_finalizationstate(fork1, {'currentDynasty': 4,
                                          'currentEpoch': 9,
                                          'lastJustifiedEpoch': 8,
@@ -249,9 +255,9 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
 
         # test that re-org before finalization is not possible
         #                                         J               J*
-        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[56, 57] fork1
+        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[1, 2] fork1
         # F    F    F    F    F    J /                                      |
-        # e0 - e1 - e2 - e3 - e4 - e5                                       56] node
+        # e0 - e1 - e2 - e3 - e4 - e5                                       1] node
         #                            \       J
         #                             - e6 - e7 - e8 fork2
         # e11 is not justified for node
@@ -260,9 +266,10 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
 
         known_fork1_hash = fork1.getblockhash(known_fork1_height)
         assert_equal(node.getblockhash(known_fork1_height), known_fork1_hash)
-        create_justification(fork=fork1, finalizer=finalizer1, after_blocks=14)
+        create_justification(fork=fork1, finalizer=finalizer1,
+                             after_blocks=height(12, 2) - height(9, 3))
 
-        assert_equal(fork1.getblockcount(), 57)
+        assert_equal(fork1.getblockcount(), height(12, 2))
         assert_finalizationstate(fork1, {'currentDynasty': 4,
                                          'currentEpoch': 12,
                                          'lastJustifiedEpoch': 11,
@@ -273,16 +280,22 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         network_thread_start()
         attacker.wait_for_verack()
 
-        # send blocks without the last one that has a justified vote
-        node_blocks = node.getblockcount()
-        for h in range(known_fork1_height + 1, fork1.getblockcount()):
-            block_hash = fork1.getblockhash(h)
-            block = FromHex(CBlock(), fork1.getblock(block_hash, 0))
+        # send blocks without the last one that has a justified vote,
+        # that one is kept to be sent after the node switches to fork2
+        # the node processes messages of a peer in order, so it is enough
+        # to wait once after all the blocks were sent
+        fork1_tip = height(12, 2)
+        heights = range(known_fork1_height + 1, fork1_tip + 1)
+        block_hashes = fork1.batch([fork1.getblockhash.get_request(h) for h in heights])
+        raw_blocks = fork1.batch([fork1.getblock.get_request(r['result'], 0) for r in block_hashes])
+        blocks = [FromHex(CBlock(), r['result']) for r in raw_blocks]
+        justifying_block = blocks.pop()
+        justifying_block.calc_sha256()
+        for block in blocks:
             attacker.send_message(msg_witness_block(block))
-            node_blocks += 1
-            wait_until(lambda: node.getblockcount() == node_blocks, timeout=15)
+        node.waitforblockheight(fork1_tip - 1, 30000)
 
-        assert_equal(node.getblockcount(), 56)
+        assert_equal(node.getblockcount(), fork1_tip - 1)
         assert_finalizationstate(node, {'currentDynasty': 4,
                                         'currentEpoch': 12,
                                         'lastJustifiedEpoch': 8,
@@ -291,29 +304,31 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
 
         # create finalization
         #                                         J               J
-        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[56, 57] fork1
+        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[1, 2] fork1
         # F    F    F    F    F    J /                                      |
-        # e0 - e1 - e2 - e3 - e4 - e5                                       56] node
+        # e0 - e1 - e2 - e3 - e4 - e5                                       1] node
         #                            \       J         F    J
-        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[56, 57] fork2
-        create_justification(fork=fork2, finalizer=finalizer2, after_blocks=11)
-        assert_equal(fork2.getblockcount(), 48)
+        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[1, 2] fork2
+        create_justification(fork=fork2, finalizer=finalizer2,
+                             after_blocks=height(10, 3) - height(8, 2))
+        assert_equal(fork2.getblockcount(), height(10, 3))
         assert_finalizationstate(fork2, {'currentDynasty': 4,
                                          'currentEpoch': 10,
                                          'lastJustifiedEpoch': 9,
                                          'lastFinalizedEpoch': 4,
                                          'validators': 1})
 
-        create_justification(fork=fork2, finalizer=finalizer2, after_blocks=6)
-        assert_equal(fork2.getblockcount(), 54)
+        create_justification(fork=fork2, finalizer=finalizer2,
+                             after_blocks=height(11, 2) - height(10, 3))
+        assert_equal(fork2.getblockcount(), height(11, 2))
         assert_finalizationstate(fork2, {'currentDynasty': 4,
                                          'currentEpoch': 11,
                                          'lastJustifiedEpoch': 10,
                                          'lastFinalizedEpoch': 9,
                                          'validators': 1})
 
-        fork2.generatetoaddress(3, fork2.getnewaddress('', 'bech32'))
-        assert_equal(fork2.getblockcount(), 57)
+        fork2.generatetoaddress(height(12, 2) - height(11, 2), fork2.new_address)
+        assert_equal(fork2.getblockcount(), height(12, 2))
         assert_finalizationstate(fork2, {'currentDynasty': 5,
                                          'currentEpoch': 12,
                                          'lastJustifiedEpoch': 10,
@@ -322,15 +337,15 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
 
         # node follows longer finalization
         #                                         J               J
-        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[56, 57] fork1
+        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[1, 2] fork1
         # F    F    F    F    F    J /
         # e0 - e1 - e2 - e3 - e4 - e5
         #                            \       J         F    J
-        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[56, 57] fork2, node
-        tip = fork2.getblockhash(57)
+        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[1, 2] fork2, node
+        tip = fork2.getblockhash(height(12, 2))
         sync_node_to_fork(node, fork2)
 
-        assert_equal(node.getblockcount(), 57)
+        assert_equal(node.getblockcount(), height(12, 2))
         assert_finalizationstate(node, {'currentDynasty': 5,
                                         'currentEpoch': 12,
                                         'lastJustifiedEpoch': 10,
@@ -340,21 +355,18 @@ class ForkChoiceParallelJustificationsTest(UnitETestFramework):
         # send block with surrounded vote that justifies longer fork
         # node's view:
         #                                         J               J
-        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[56, 57] fork1
+        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[1, 2] fork1
         # F    F    F    F    F    J /
         # e0 - e1 - e2 - e3 - e4 - e5
         #                            \       J         F    J
-        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[56, 57] fork2, node
+        #                             - e6 - e7 - e8 - e9 - e10 - e11 - e12[1, 2] fork2, node
 
-        block_hash = fork1.getblockhash(fork1.getblockcount())
-        block = FromHex(CBlock(), fork1.getblock(block_hash, 0))
-        block.calc_sha256()
-        attacker.send_message(msg_witness_block(block))
+        attacker.send_message(msg_witness_block(justifying_block))
 
         # node should't re-org to malicious fork
-        wait_for_reject(attacker, b'bad-fork-before-last-finalized-epoch', block.sha256)
-        assert_equal(node.getblockcount(), 57)
-        assert_equal(node.getblockhash(57), tip)
+        attacker.wait_for_reject(b'bad-fork-before-last-finalized-epoch', justifying_block.sha256)
+        assert_equal(node.getblockcount(), height(12, 2))
+        assert_equal(node.getblockhash(height(12, 2)), tip)
         assert_finalizationstate(node, {'currentDynasty': 5,
                                         'currentEpoch': 12,
                                         'lastJustifiedEpoch': 10,
@@ -85,7 +85,6 @@ class BaseNode(P2PInterface):
             return
 
         msg = msg_headers()
-        msg.status = 1
         for h in self.headers:
             msg.headers.append(h)
         self.send_message(msg)
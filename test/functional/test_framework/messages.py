@@ -14,11 +14,11 @@ msg_block, msg_tx, msg_headers, etc.:
     data structures that represent network messages
 
 ser_*, deser_*: functions that handle serialization/deserialization."""
-from codecs import encode
 from enum import Enum
-import copy
 import hashlib
-from io import BytesIO
+from io import BytesIO, SEEK_CUR
+from itertools import accumulate, chain, repeat
+from operator import attrgetter
 import random
 import socket
 import struct
@@ -47,37 +47,72 @@ NODE_NETWORK_LIMITED = (1 << 10)
 NODE_SNAPSHOT = (1 << 15)
 
 # Serialization/deserialization tools
+# Precompiled structs for the fixed width integer fields. Unpacking through
+# these beats int.from_bytes on single values, while packing is on par with
+# int.to_bytes, so only the 256 bit fields, which struct can't express, go
+# through int conversions.
+_U8 = struct.Struct("<B")
+_I8 = struct.Struct("<b")
+_U16 = struct.Struct("<H")
+_U16_BE = struct.Struct(">H")
+_U32 = struct.Struct("<I")
+_I32 = struct.Struct("<i")
+_U64 = struct.Struct("<Q")
+_I64 = struct.Struct("<q")
+_UINT256 = struct.Struct("32s")
+_U8_U16 = struct.Struct("<BH")
+_U8_U32 = struct.Struct("<BI")
+_U8_U64 = struct.Struct("<BQ")
+# fixed layouts of whole objects, uint256 fields are packed as 32 byte strings
+_OUTPOINT = struct.Struct("<32sI")
+_INV = struct.Struct("<i32s")
+_ADDRESS = struct.Struct("<Q12s4s2s")
+_HEADER = struct.Struct("<i32s32s32s32sII")
+_VERSION_HEAD = struct.Struct("<iQq")
+_SENDCMPCT = struct.Struct("<?Q")
+_SNAPSHOT_HEADER = struct.Struct("<32s32s32s32sQ")
+_GETSNAPSHOT = struct.Struct("<32sQH")
+_UTXO_SUBSET_HEAD = struct.Struct("<32sIB")
+_BLOOM_FILTER_TAIL = struct.Struct("<IIB")
+
+_sha256 = hashlib.sha256
+
 def sha256(s):
-    return hashlib.sha256(s).digest()
+    return _sha256(s).digest()
 
 def ripemd160(s):
     return hashlib.new('ripemd160', s).digest()
 
 def hash256(s):
-    return sha256(sha256(s))
+    return _sha256(_sha256(s).digest()).digest()
+
+# encodings of the single byte compact sizes
+_COMPACT_SMALL = [bytes((i,)) for i in range(253)]
 
 def ser_compact_size(l):
-    r = b""
-    if l < 253:
-        r = struct.pack("B", l)
-    elif l < 0x10000:
-        r = struct.pack("<BH", 253, l)
-    elif l < 0x100000000:
-        r = struct.pack("<BI", 254, l)
-    else:
-        r = struct.pack("<BQ", 255, l)
-    return r
+    if 0 <= l < 253:
+        return _COMPACT_SMALL[l]
+    if l < 0x10000:
+        return _U8_U16.pack(253, l)
+    if l < 0x100000000:
+        return _U8_U32.pack(254, l)
+    return _U8_U64.pack(255, l)
 
 def deser_compact_size(f):
-    nit = struct.unpack("<B", f.read(1))[0]
+    nit = _U8.unpack(f.read(1))[0]
+    if nit < 253:
+        return nit
     if nit == 253:
-        nit = struct.unpack("<H", f.read(2))[0]
+        nit = _U16.unpack(f.read(2))[0]
     elif nit == 254:
-        nit = struct.unpack("<I", f.read(4))[0]
+        nit = _U32.unpack(f.read(4))[0]
     elif nit == 255:
-        nit = struct.unpack("<Q", f.read(8))[0]
+        nit = _U64.unpack(f.read(8))[0]
     return nit
 
+def _read_struct(f, s):
+    return s.unpack(f.read(s.size))
+
 def deser_string(f):
     nit = deser_compact_size(f)
     return f.read(nit)
@@ -86,23 +121,19 @@ def ser_string(s):
     return ser_compact_size(len(s)) + s
 
 def deser_uint32(f):
-    return struct.unpack("<I", f.read(4))[0]
+    return _U32.unpack(f.read(4))[0]
 
 def deser_uint64(f):
-    return struct.unpack("<Q", f.read(8))[0]
+    return _U64.unpack(f.read(8))[0]
 
 def deser_uint256(f):
-    r = 0
-    for i in range(8):
-        t = deser_uint32(f)
-        r += t << (i * 32)
-    return r
+    return int.from_bytes(f.read(32), 'little')
 
 def ser_uint32(u):
-    return struct.pack("<I", u & 0xFFFFFFFF)
+    return _U32.pack(u & 0xFFFFFFFF)
 
 def ser_uint64(u):
-    return struct.pack("<Q", u & 0xFFFFFFFFFFFFFFFF)
+    return _U64.pack(u & 0xFFFFFFFFFFFFFFFF)
 
 def ser_uint256(u):
     return int(u).to_bytes(32, 'little')
@@ -119,6 +150,9 @@ def uint256_from_compact(c):
 
 
 def deser_vector(f, c):
+    if hasattr(c, 'deserialize_from'):
+        # decode the whole vector from the stream's buffer in one go
+        return _read_stream(f, _read_vector, c)
     nit = deser_compact_size(f)
     r = []
     for i in range(nit):
@@ -132,20 +166,99 @@ def deser_vector(f, c):
 # entries in the vector (we use this for serializing the vector of transactions
 # for a witness block).
 def ser_vector(l, ser_function_name=None):
-    r = ser_compact_size(len(l))
-    for i in l:
-        if ser_function_name:
-            r += getattr(i, ser_function_name)()
-        else:
-            r += i.serialize()
+    if ser_function_name:
+        parts = [getattr(i, ser_function_name)() for i in l]
+    else:
+        parts = [i.serialize() for i in l]
+    return ser_compact_size(len(l)) + b"".join(parts)
+
+
+# Buffer based counterparts of the deser_* functions. Each of them takes a
+# bytes-like buffer and an offset and returns the decoded value together with
+# the offset right behind it.
+def _read_compact_size(buf, off):
+    nit = buf[off]
+    if nit < 253:
+        return nit, off + 1
+    if nit == 253:
+        return _U16.unpack_from(buf, off + 1)[0], off + 3
+    elif nit == 254:
+        return _U32.unpack_from(buf, off + 1)[0], off + 5
+    return _U64.unpack_from(buf, off + 1)[0], off + 9
+
+
+def _read_string(buf, off):
+    nit, off = _read_compact_size(buf, off)
+    return bytes(buf[off:off + nit]), off + nit
+
+
+def _read_uint256(buf, off):
+    return int.from_bytes(buf[off:off + 32], 'little'), off + 32
+
+
+def _read_vector(buf, off, c):
+    nit, off = _read_compact_size(buf, off)
+    r = []
+    for i in range(nit):
+        t = c()
+        off = t.deserialize_from(buf, off)
+        r.append(t)
+    return r, off
+
+
+def _read_string_vector(buf, off):
+    nit, off = _read_compact_size(buf, off)
+    r = []
+    for i in range(nit):
+        t, off = _read_string(buf, off)
+        r.append(t)
+    return r, off
+
+
+def _read_uint32_map(buf, off, klass):
+    size, off = _read_compact_size(buf, off)
+    m = dict()
+    for _ in range(size):
+        k = _U32.unpack_from(buf, off)[0]
+        o = klass()
+        off = o.deserialize_from(buf, off + 4)
+        m[k] = o
+    return m, off
+
+
+def _read_object(buf, off, obj):
+    return obj, obj.deserialize_from(buf, off)
+
+
+# Run one of the buffer readers above on a stream and advance the stream past
+# the decoded bytes. A BytesIO is decoded in place through its buffer, other
+# (seekable) streams from a copy of their remaining data.
+def _read_stream(f, reader, *args):
+    if hasattr(f, 'getbuffer'):
+        with f.getbuffer() as buf:
+            r, off = reader(buf, f.tell(), *args)
+        f.seek(off)
+    else:
+        data = f.read()
+        r, off = reader(data, 0, *args)
+        f.seek(off - len(data), SEEK_CUR)
     return r
 
 
+# Deserialize an object which implements deserialize_from from a stream,
+# reading its fields straight out of the stream's buffer.
+def _deserialize_stream(obj, f):
+    _read_stream(f, _read_object, obj)
+
+
 def deser_uint32_map(f, klass):
+    if hasattr(klass, 'deserialize_from'):
+        # decode the whole map from the stream's buffer in one go
+        return _read_stream(f, _read_uint32_map, klass)
     m = dict()
     size = deser_compact_size(f)
     for _ in range(size):
-        k = struct.unpack('<I', f.read(4))[0]
+        k = _U32.unpack(f.read(4))[0]
         o = klass()
         o.deserialize(f)
         m[k] = o
@@ -153,27 +266,18 @@ def deser_uint32_map(f, klass):
 
 
 def ser_uint32_map(d):
-    r = ser_compact_size(len(d))
-    for i in d:
-        r += struct.pack('<I', i)
-        r += d[i].serialize()
-    return r
+    return ser_compact_size(len(d)) + b"".join(
+        [_U32.pack(k) + v.serialize() for k, v in d.items()])
 
 
 def deser_uint256_vector(f):
     nit = deser_compact_size(f)
-    r = []
-    for i in range(nit):
-        t = deser_uint256(f)
-        r.append(t)
-    return r
+    # read all entries at once and split the buffer into 32 byte words
+    return [int.from_bytes(h, 'little') for (h,) in _UINT256.iter_unpack(f.read(32 * nit))]
 
 
 def ser_uint256_vector(l):
-    r = ser_compact_size(len(l))
-    for i in l:
-        r += ser_uint256(i)
-    return r
+    return ser_compact_size(len(l)) + b"".join([int(u).to_bytes(32, 'little') for u in l])
 
 
 def deser_string_vector(f):
@@ -186,16 +290,20 @@ def deser_string_vector(f):
 
 
 def ser_string_vector(l):
-    r = ser_compact_size(len(l))
-    for sv in l:
-        r += ser_string(sv)
-    return r
+    return ser_compact_size(len(l)) + b"".join([ser_string(sv) for sv in l])
 
 
+# Deserialize from a binary representation
+def FromBytes(obj, data):
+    if hasattr(obj, 'deserialize_from'):
+        obj.deserialize_from(data, 0)
+    else:
+        obj.deserialize(BytesIO(data))
+    return obj
+
 # Deserialize from a hex string representation (eg from RPC)
 def FromHex(obj, hex_string):
-    obj.deserialize(BytesIO(hex_str_to_bytes(hex_string)))
-    return obj
+    return FromBytes(obj, hex_str_to_bytes(hex_string))
 
 # Convert a binary-serializable object to hex (eg for submission via RPC)
 def ToHex(obj):
@@ -203,26 +311,30 @@ def ToHex(obj):
 
 # Objects that map to unit-e objects, which can be serialized/deserialized
 
+# prefix of an IPv4-mapped IPv6 address
+IPV4_MAPPED_PREFIX = b"\x00" * 10 + b"\xff" * 2
+
 class CAddress():
+    __slots__ = ("nServices", "pchReserved", "ip", "port")
+
     def __init__(self):
         self.nServices = 1
-        self.pchReserved = b"\x00" * 10 + b"\xff" * 2
+        self.pchReserved = IPV4_MAPPED_PREFIX
         self.ip = "0.0.0.0"
         self.port = 0
 
     def deserialize(self, f):
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
-        self.pchReserved = f.read(12)
-        self.ip = socket.inet_ntoa(f.read(4))
-        self.port = struct.unpack(">H", f.read(2))[0]
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        self.nServices, self.pchReserved, ip, port = _ADDRESS.unpack_from(buf, off)
+        self.ip = socket.inet_ntoa(ip)
+        self.port = _U16_BE.unpack(port)[0]
+        return off + _ADDRESS.size
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nServices)
-        r += self.pchReserved
-        r += socket.inet_aton(self.ip)
-        r += struct.pack(">H", self.port)
-        return r
+        return _ADDRESS.pack(self.nServices, self.pchReserved,
+                             socket.inet_aton(self.ip), _U16_BE.pack(self.port))
 
     def __repr__(self):
         return "CAddress(nServices=%i ip=%s port=%i)" % (self.nServices,
@@ -245,14 +357,15 @@ class CInv():
         self.hash = h
 
     def deserialize(self, f):
-        self.type = struct.unpack("<i", f.read(4))[0]
-        self.hash = deser_uint256(f)
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        self.type, h = _INV.unpack_from(buf, off)
+        self.hash = int.from_bytes(h, 'little')
+        return off + _INV.size
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.type)
-        r += ser_uint256(self.hash)
-        return r
+        return _INV.pack(self.type, ser_uint256(self.hash))
 
     def __repr__(self):
         return "CInv(type=%s hash=%064x)" \
@@ -265,14 +378,14 @@ class CBlockLocator():
         self.vHave = []
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion = _I32.unpack(f.read(4))[0]
         self.vHave = deser_uint256_vector(f)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256_vector(self.vHave)
-        return r
+        return b"".join((
+            _I32.pack(self.nVersion),
+            ser_uint256_vector(self.vHave),
+        ))
 
     def __repr__(self):
         return "CBlockLocator(nVersion=%i vHave=%s)" \
@@ -280,19 +393,25 @@ class CBlockLocator():
 
 
 class COutPoint():
+    __slots__ = ("hash", "n")
+
     def __init__(self, hash=0, n=0):
         self.hash = hash
         self.n = n
 
     def deserialize(self, f):
-        self.hash = deser_uint256(f)
-        self.n = struct.unpack("<I", f.read(4))[0]
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        h, self.n = _OUTPOINT.unpack_from(buf, off)
+        self.hash = int.from_bytes(h, 'little')
+        return off + _OUTPOINT.size
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.hash)
-        r += struct.pack("<I", self.n)
-        return r
+        return _OUTPOINT.pack(ser_uint256(self.hash), self.n)
+
+    def copy(self):
+        return COutPoint(self.hash, self.n)
 
     def is_null(self):
         return self.hash == 0
@@ -302,6 +421,8 @@ class COutPoint():
 
 
 class CTxIn():
+    __slots__ = ("prevout", "scriptSig", "nSequence")
+
     def __init__(self, outpoint=None, scriptSig=b"", nSequence=0):
         if outpoint is None:
             self.prevout = COutPoint()
@@ -311,17 +432,24 @@ class CTxIn():
         self.nSequence = nSequence
 
     def deserialize(self, f):
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
         self.prevout = COutPoint()
-        self.prevout.deserialize(f)
-        self.scriptSig = deser_string(f)
-        self.nSequence = struct.unpack("<I", f.read(4))[0]
+        off = self.prevout.deserialize_from(buf, off)
+        self.scriptSig, off = _read_string(buf, off)
+        self.nSequence = _U32.unpack_from(buf, off)[0]
+        return off + 4
 
     def serialize(self):
-        r = b""
-        r += self.prevout.serialize()
-        r += ser_string(self.scriptSig)
-        r += struct.pack("<I", self.nSequence)
-        return r
+        return b"".join((
+            self.prevout.serialize(),
+            ser_string(self.scriptSig),
+            _U32.pack(self.nSequence),
+        ))
+
+    def copy(self):
+        return CTxIn(self.prevout.copy(), self.scriptSig, self.nSequence)
 
     def __repr__(self):
         return "CTxIn(prevout=%s scriptSig=%s nSequence=%i)" \
@@ -330,19 +458,28 @@ class CTxIn():
 
 
 class CTxOut():
+    __slots__ = ("nValue", "scriptPubKey")
+
     def __init__(self, nValue=0, scriptPubKey=b""):
         self.nValue = int(nValue)
         self.scriptPubKey = scriptPubKey
 
     def deserialize(self, f):
-        self.nValue = struct.unpack("<q", f.read(8))[0]
-        self.scriptPubKey = deser_string(f)
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        self.nValue = _I64.unpack_from(buf, off)[0]
+        self.scriptPubKey, off = _read_string(buf, off + 8)
+        return off
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<q", self.nValue)
-        r += ser_string(self.scriptPubKey)
-        return r
+        return b"".join((
+            _I64.pack(self.nValue),
+            ser_string(self.scriptPubKey),
+        ))
+
+    def copy(self):
+        return CTxOut(self.nValue, self.scriptPubKey)
 
     def is_unspendable(self):
         if len(self.scriptPubKey) > 0:
@@ -367,6 +504,16 @@ class TxType(Enum):
     ADMIN = 7
 
 
+FINALIZER_COMMIT_TYPES = frozenset((
+    TxType.DEPOSIT,
+    TxType.VOTE,
+    TxType.LOGOUT,
+    TxType.SLASH,
+    TxType.WITHDRAW,
+    TxType.ADMIN,
+))
+
+
 class UTXO:
     def __init__(self, height, tx_type, outpoint, tx_out):
         self.outpoint = outpoint
@@ -377,18 +524,18 @@ class UTXO:
     def deserialize(self, f):
         self.outpoint = COutPoint()
         self.outpoint.deserialize(f)
-        self.height = struct.unpack("<I", f.read(4))[0]
-        self.tx_type = TxType(struct.unpack("<B", f.read[1])[0])
+        self.height = _U32.unpack(f.read(4))[0]
+        self.tx_type = TxType(_U8.unpack(f.read(1))[0])
         self.txOut = CTxOut()
         self.txOut.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.outpoint.serialize()
-        r += struct.pack("<I", self.height)
-        r += struct.pack("<B", self.tx_type.value)
-        r += self.txOut.serialize()
-        return r
+        return b"".join((
+            self.outpoint.serialize(),
+            _U32.pack(self.height),
+            _U8.pack(self.tx_type.value),
+            self.txOut.serialize(),
+        ))
 
     def __repr__(self):
         return "UTXO(outpoint=%s height=%i tx_type=%s txOut=%s)" \
@@ -415,11 +562,20 @@ class CTxInWitness():
         self.scriptWitness = CScriptWitness()
 
     def deserialize(self, f):
-        self.scriptWitness.stack = deser_string_vector(f)
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        self.scriptWitness.stack, off = _read_string_vector(buf, off)
+        return off
 
     def serialize(self):
         return ser_string_vector(self.scriptWitness.stack)
 
+    def copy(self):
+        r = CTxInWitness()
+        r.scriptWitness.stack = list(self.scriptWitness.stack)
+        return r
+
     def __repr__(self):
         return repr(self.scriptWitness)
 
@@ -432,16 +588,22 @@ class CTxWitness():
         self.vtxinwit = []
 
     def deserialize(self, f):
-        for i in range(len(self.vtxinwit)):
-            self.vtxinwit[i].deserialize(f)
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        for x in self.vtxinwit:
+            off = x.deserialize_from(buf, off)
+        return off
 
     def serialize(self):
-        r = b""
         # This is different than the usual vector serialization --
         # we omit the length of the vector, which is required to be
         # the same length as the transaction's vin vector.
-        for x in self.vtxinwit:
-            r += x.serialize()
+        return b"".join([x.serialize() for x in self.vtxinwit])
+
+    def copy(self):
+        r = CTxWitness()
+        r.vtxinwit = [x.copy() for x in self.vtxinwit]
         return r
 
     def __repr__(self):
@@ -467,85 +629,83 @@ class CTransaction():
             self.hash = None
         else:
             self.nVersion = tx.nVersion
-            self.vin = copy.deepcopy(tx.vin)
-            self.vout = copy.deepcopy(tx.vout)
+            self.vin = [x.copy() for x in tx.vin]
+            self.vout = [x.copy() for x in tx.vout]
             self.nLockTime = tx.nLockTime
             self.sha256 = tx.sha256
             self.hash = tx.hash
-            self.wit = copy.deepcopy(tx.wit)
+            self.wit = tx.wit.copy()
+        # nVersion the cached type was derived from, tests assign nVersion directly
+        self._type_version = None
+        self._type = None
 
     def set_type(self, tx_type):
         self.nVersion = (self.nVersion & 0x0000FFFF) | (tx_type.value << 16)
 
     def get_type(self):
-        return TxType(self.nVersion >> 16)
+        if self._type_version != self.nVersion:
+            self._type = TxType(self.nVersion >> 16)
+            self._type_version = self.nVersion
+        return self._type
 
     def is_finalizer_commit(self):
-        name = self.get_type()
-        if (name == TxType.VOTE or
-            name == TxType.ADMIN or
-            name == TxType.DEPOSIT or
-            name == TxType.LOGOUT or
-            name == TxType.SLASH or
-            name == TxType.WITHDRAW):
-            return True
-
-        if (name == TxType.COINBASE or
-            name == TxType.REGULAR):
-            return False
-
-        assert False, ('unknown type: %s' % name)
+        return self.get_type() in FINALIZER_COMMIT_TYPES
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.vin = deser_vector(f, CTxIn)
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        self.nVersion = _I32.unpack_from(buf, off)[0]
+        self.vin, off = _read_vector(buf, off + 4, CTxIn)
         flags = 0
         if len(self.vin) == 0:
-            flags = struct.unpack("<B", f.read(1))[0]
+            flags = _U8.unpack_from(buf, off)[0]
+            off += 1
             # Not sure why flags can't be zero, but this
             # matches the implementation in unit-e
             if (flags != 0):
-                self.vin = deser_vector(f, CTxIn)
-                self.vout = deser_vector(f, CTxOut)
+                self.vin, off = _read_vector(buf, off, CTxIn)
+                self.vout, off = _read_vector(buf, off, CTxOut)
         else:
-            self.vout = deser_vector(f, CTxOut)
+            self.vout, off = _read_vector(buf, off, CTxOut)
         if flags != 0:
             self.wit.vtxinwit = [CTxInWitness() for i in range(len(self.vin))]
-            self.wit.deserialize(f)
-        self.nLockTime = struct.unpack("<I", f.read(4))[0]
+            off = self.wit.deserialize_from(buf, off)
+        self.nLockTime = _U32.unpack_from(buf, off)[0]
         self.sha256 = None
         self.hash = None
+        return off + 4
 
     def serialize_without_witness(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
-        r += struct.pack("<I", self.nLockTime)
-        return r
+        return b"".join((
+            _I32.pack(self.nVersion),
+            ser_vector(self.vin),
+            ser_vector(self.vout),
+            _U32.pack(self.nLockTime),
+        ))
 
     # Only serialize with witness when explicitly called for
     def serialize_with_witness(self):
         flags = 0
         if not self.wit.is_null():
             flags |= 1
-        r = b""
-        r += struct.pack("<i", self.nVersion)
+        parts = []
+        parts.append(_I32.pack(self.nVersion))
         if flags:
             dummy = []
-            r += ser_vector(dummy)
-            r += struct.pack("<B", flags)
-        r += ser_vector(self.vin)
-        r += ser_vector(self.vout)
+            parts.append(ser_vector(dummy))
+            parts.append(_U8.pack(flags))
+        parts.append(ser_vector(self.vin))
+        parts.append(ser_vector(self.vout))
         if flags & 1:
             if (len(self.wit.vtxinwit) != len(self.vin)):
                 # vtxinwit must have the same length as vin
                 self.wit.vtxinwit = self.wit.vtxinwit[:len(self.vin)]
                 for i in range(len(self.wit.vtxinwit), len(self.vin)):
                     self.wit.vtxinwit.append(CTxInWitness())
-            r += self.wit.serialize()
-        r += struct.pack("<I", self.nLockTime)
-        return r
+            parts.append(self.wit.serialize())
+        parts.append(_U32.pack(self.nLockTime))
+        return b"".join(parts)
 
     # Regular serialization is with witness -- must explicitly
     # call serialize_without_witness to exclude witness data.
@@ -564,9 +724,22 @@ class CTransaction():
             # Don't cache the result, just return it
             return uint256_from_str(hash256(self.serialize_with_witness()))
 
+        digest = hash256(self.serialize_without_witness())
+        if self.sha256 is None:
+            self.sha256 = uint256_from_str(digest)
+        self.hash = digest[::-1].hex()
+
+    # Same as calc_sha256() followed by calc_sha256(True), returns the hash
+    # with witness. Without witness data both serializations are identical,
+    # so the transaction is only serialized and hashed once in that case.
+    def calc_hashes(self):
+        digest = hash256(self.serialize_without_witness())
         if self.sha256 is None:
-            self.sha256 = uint256_from_str(hash256(self.serialize_without_witness()))
-        self.hash = encode(hash256(self.serialize_without_witness())[::-1], 'hex_codec').decode('ascii')
+            self.sha256 = uint256_from_str(digest)
+        self.hash = digest[::-1].hex()
+        if self.wit.is_null():
+            return uint256_from_str(digest)
+        return uint256_from_str(hash256(self.serialize_with_witness()))
 
     def is_valid(self):
         self.calc_sha256()
@@ -576,7 +749,7 @@ class CTransaction():
         return True
 
     def is_coin_base(self):
-        return TxType(self.nVersion >> 16) == TxType.COINBASE
+        return self.get_type() == TxType.COINBASE
 
     def __repr__(self):
         return "CTransaction(nVersion=%i vin=%s vout=%s wit=%s nLockTime=%i)" \
@@ -611,39 +784,37 @@ class CBlockHeader():
         self.hash = None
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
-        self.hashPrevBlock = deser_uint256(f)
-        self.hashMerkleRoot = deser_uint256(f)
-        self.hash_witness_merkle_root = deser_uint256(f)
-        self.hash_finalizer_commits_merkle_root = deser_uint256(f)
-        self.nTime = struct.unpack("<I", f.read(4))[0]
-        self.nBits = struct.unpack("<I", f.read(4))[0]
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        (self.nVersion, prev_block, merkle_root, witness_merkle_root,
+         finalizer_commits_merkle_root, self.nTime, self.nBits) = _HEADER.unpack_from(buf, off)
+        self.hashPrevBlock = uint256_from_str(prev_block)
+        self.hashMerkleRoot = uint256_from_str(merkle_root)
+        self.hash_witness_merkle_root = uint256_from_str(witness_merkle_root)
+        self.hash_finalizer_commits_merkle_root = uint256_from_str(finalizer_commits_merkle_root)
         self.sha256 = None
         self.hash = None
+        return off + _HEADER.size
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += ser_uint256(self.hashPrevBlock)
-        r += ser_uint256(self.hashMerkleRoot)
-        r += ser_uint256(self.hash_witness_merkle_root)
-        r += ser_uint256(self.hash_finalizer_commits_merkle_root)
-        r += struct.pack("<I", self.nTime)
-        r += struct.pack("<I", self.nBits)
-        return r
+        return _HEADER.pack(self.nVersion,
+                            ser_uint256(self.hashPrevBlock),
+                            ser_uint256(self.hashMerkleRoot),
+                            ser_uint256(self.hash_witness_merkle_root),
+                            ser_uint256(self.hash_finalizer_commits_merkle_root),
+                            self.nTime,
+                            self.nBits)
+
+    # Subclasses such as CBlock extend serialize, this always yields the header
+    def serialize_header_only(self):
+        return CBlockHeader.serialize(self)
 
     def calc_sha256(self):
         if self.sha256 is None:
-            r = b""
-            r += struct.pack("<i", self.nVersion)
-            r += ser_uint256(self.hashPrevBlock)
-            r += ser_uint256(self.hashMerkleRoot)
-            r += ser_uint256(self.hash_witness_merkle_root)
-            r += ser_uint256(self.hash_finalizer_commits_merkle_root)
-            r += struct.pack("<I", self.nTime)
-            r += struct.pack("<I", self.nBits)
-            self.sha256 = uint256_from_str(hash256(r))
-            self.hash = encode(hash256(r)[::-1], 'hex_codec').decode('ascii')
+            digest = hash256(self.serialize_header_only())
+            self.sha256 = uint256_from_str(digest)
+            self.hash = digest[::-1].hex()
 
     def rehash(self):
         self.sha256 = None
@@ -667,34 +838,43 @@ class CBlock(CBlockHeader):
         super(CBlock, self).__init__(header)
         self.vtx = []
 
-    def deserialize(self, f):
-        super(CBlock, self).deserialize(f)
-        self.vtx = deser_vector(f, CTransaction)
+    def deserialize_from(self, buf, off):
+        off = super(CBlock, self).deserialize_from(buf, off)
+        self.vtx, off = _read_vector(buf, off, CTransaction)
+        return off
 
     def serialize(self, with_witness=False):
-        r = b""
-        r += super(CBlock, self).serialize()
+        parts = []
+        parts.append(super(CBlock, self).serialize())
         if with_witness:
-            r += ser_vector(self.vtx, "serialize_with_witness")
+            parts.append(ser_vector(self.vtx, "serialize_with_witness"))
         else:
-            r += ser_vector(self.vtx, "serialize_without_witness")
+            parts.append(ser_vector(self.vtx, "serialize_without_witness"))
         # UNIT-E: serialize an empty block signature on top of the block
         # this is just an interim solution
-        r += ser_vector([])
-        return r
+        parts.append(ser_vector([]))
+        return b"".join(parts)
 
     # Calculate the merkle root given a vector of transaction hashes
     @classmethod
     def get_merkle_root(cls, hashes):
         if len(hashes) == 0:
             return 0
-        while len(hashes) > 1:
-            newhashes = []
-            for i in range(0, len(hashes), 2):
-                i2 = min(i+1, len(hashes)-1)
-                newhashes.append(hash256(hashes[i] + hashes[i2]))
-            hashes = newhashes
-        return uint256_from_str(hashes[0])
+        # all levels live in one buffer, each level overwrites the front of
+        # the previous one
+        level = bytearray(b"".join(hashes))
+        n = len(hashes)
+        while n > 1:
+            # the last hash of a level with an odd size is paired with itself
+            if n % 2:
+                level[32*n:32*n+32] = level[32*n-32:32*n]
+                n += 1
+            view = memoryview(level)
+            for i in range(n // 2):
+                level[32*i:32*i+32] = hash256(view[64*i:64*i+64])
+            view.release()
+            n //= 2
+        return uint256_from_str(level)
 
     def calc_merkle_root(self):
         hashes = []
@@ -718,10 +898,26 @@ class CBlock(CBlockHeader):
                 hashes.append(ser_uint256(tx.sha256))
         return self.get_merkle_root(hashes)
 
+    # Calculate the merkle root, witness merkle root and finalizer commits
+    # merkle root in a single pass over the transactions
+    def calc_merkle_roots(self):
+        hashes = []
+        witness_hashes = []
+        finalizer_commit_hashes = []
+        for tx in self.vtx:
+            witness_hashes.append(ser_uint256(tx.calc_hashes()))
+            txid = ser_uint256(tx.sha256)
+            hashes.append(txid)
+            if tx.is_finalizer_commit():
+                finalizer_commit_hashes.append(txid)
+        return (self.get_merkle_root(hashes),
+                self.get_merkle_root(witness_hashes),
+                self.get_merkle_root(finalizer_commit_hashes))
+
     def compute_merkle_trees(self):
-        self.hashMerkleRoot = self.calc_merkle_root()
-        self.hash_witness_merkle_root = self.calc_witness_merkle_root()
-        self.hash_finalizer_commits_merkle_root = self.calc_finalizer_commits_merkle_root()
+        (self.hashMerkleRoot,
+         self.hash_witness_merkle_root,
+         self.hash_finalizer_commits_merkle_root) = self.calc_merkle_roots()
 
     def is_valid(self):
         self.calc_sha256()
@@ -731,13 +927,9 @@ class CBlock(CBlockHeader):
         for tx in self.vtx:
             if not tx.is_valid():
                 return False
-        if self.calc_merkle_root() != self.hashMerkleRoot:
-            return False
-        if self.calc_witness_merkle_root() != self.hash_witness_merkle_root:
-            return False
-        if self.calc_finalizer_commits_merkle_root() != self.hash_finalizer_commits_merkle_root:
-            return False
-        return True
+        return self.calc_merkle_roots() == (self.hashMerkleRoot,
+                                            self.hash_witness_merkle_root,
+                                            self.hash_finalizer_commits_merkle_root)
 
     def solve(self):
         self.rehash()
@@ -747,7 +939,7 @@ class CBlock(CBlockHeader):
             return
         for tx in self.vtx:
             tx.rehash()
-        self.vtx = [self.vtx[0]] + sorted(self.vtx[1:], key=lambda _tx: _tx.hash)
+        self.vtx = [self.vtx[0]] + sorted(self.vtx[1:], key=attrgetter('hash'))
 
     def __repr__(self):
         return ("CBlock(nVersion=%i "
@@ -773,13 +965,13 @@ class PrefilledTransaction():
         self.tx.deserialize(f)
 
     def serialize(self, with_witness=True):
-        r = b""
-        r += ser_compact_size(self.index)
+        parts = []
+        parts.append(ser_compact_size(self.index))
         if with_witness:
-            r += self.tx.serialize_with_witness()
+            parts.append(self.tx.serialize_with_witness())
         else:
-            r += self.tx.serialize_without_witness()
-        return r
+            parts.append(self.tx.serialize_without_witness())
+        return b"".join(parts)
 
     def serialize_without_witness(self):
         return self.serialize(with_witness=False)
@@ -802,29 +994,27 @@ class P2PHeaderAndShortIDs():
 
     def deserialize(self, f):
         self.header.deserialize(f)
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = _U64.unpack(f.read(8))[0]
         self.shortids_length = deser_compact_size(f)
-        for i in range(self.shortids_length):
-            # shortids are defined to be 6 bytes in the spec, so append
-            # two zero bytes and read it in as an 8-byte number
-            self.shortids.append(struct.unpack("<Q", f.read(6) + b'\x00\x00')[0])
+        # shortids are defined to be 6 bytes in the spec
+        data = f.read(6 * self.shortids_length)
+        self.shortids = [int.from_bytes(data[i:i+6], 'little') for i in range(0, len(data), 6)]
         self.prefilled_txn = deser_vector(f, PrefilledTransaction)
         self.prefilled_txn_length = len(self.prefilled_txn)
 
     # When using version 2 compact blocks, we must serialize with_witness.
     def serialize(self, with_witness=False):
-        r = b""
-        r += self.header.serialize()
-        r += struct.pack("<Q", self.nonce)
-        r += ser_compact_size(self.shortids_length)
-        for x in self.shortids:
-            # We only want the first 6 bytes
-            r += struct.pack("<Q", x)[0:6]
+        parts = []
+        parts.append(self.header.serialize())
+        parts.append(_U64.pack(self.nonce))
+        parts.append(ser_compact_size(self.shortids_length))
+        # We only want the first 6 bytes
+        parts.append(b"".join([x.to_bytes(8, 'little')[:6] for x in self.shortids]))
         if with_witness:
-            r += ser_vector(self.prefilled_txn, "serialize_with_witness")
+            parts.append(ser_vector(self.prefilled_txn, "serialize_with_witness"))
         else:
-            r += ser_vector(self.prefilled_txn, "serialize_without_witness")
-        return r
+            parts.append(ser_vector(self.prefilled_txn, "serialize_without_witness"))
+        return b"".join(parts)
 
     def __repr__(self):
         return "P2PHeaderAndShortIDs(header=%s, nonce=%d, shortids_length=%d, shortids=%s, prefilled_txn_length=%d, prefilledtxn=%s" % (repr(self.header), self.nonce, self.shortids_length, repr(self.shortids), self.prefilled_txn_length, repr(self.prefilled_txn))
@@ -879,28 +1069,35 @@ class HeaderAndShortIDs():
 
     def get_siphash_keys(self):
         header_nonce = self.header.serialize()
-        header_nonce += struct.pack("<Q", self.nonce)
+        header_nonce += _U64.pack(self.nonce)
         hash_header_nonce_as_str = sha256(header_nonce)
-        key0 = struct.unpack("<Q", hash_header_nonce_as_str[0:8])[0]
-        key1 = struct.unpack("<Q", hash_header_nonce_as_str[8:16])[0]
+        key0 = _U64.unpack_from(hash_header_nonce_as_str, 0)[0]
+        key1 = _U64.unpack_from(hash_header_nonce_as_str, 8)[0]
         return [ key0, key1 ]
 
     # Version 2 compact blocks use wtxid in shortids (rather than txid)
     def initialize_from_block(self, block, prefill = [], add_genesis=True, nonce=0, use_witness = True):
         self.header = CBlockHeader(block)
         self.nonce = nonce
+        # transactions are compared by identity, look them up by id()
+        prefill_ids = set(map(id, prefill))
         if add_genesis:
-            if block.vtx[0] not in prefill:
+            if id(block.vtx[0]) not in prefill_ids:
                 prefill = [block.vtx[0]] + prefill
+                prefill_ids.add(id(block.vtx[0]))
 
-        self.prefilled_txn = [ PrefilledTransaction(block.vtx.index(tx), tx) for tx in prefill ]
+        # index of the first occurrence of each transaction in the block
+        positions = {}
+        for i, tx in enumerate(block.vtx):
+            positions.setdefault(id(tx), i)
+        self.prefilled_txn = [ PrefilledTransaction(positions[id(tx)], tx) for tx in prefill ]
         self.prefilled_txn.sort(key=lambda tx: tx.index) # the prefilled transactions can be out of order
         self.shortids = []
         self.use_witness = use_witness
         [k0, k1] = self.get_siphash_keys()
 
         for tx in block.vtx:
-            if tx not in prefill:
+            if id(tx) not in prefill_ids:
                 tx_hash = tx.sha256
                 if use_witness:
                     tx_hash = tx.calc_sha256(with_witness=True)
@@ -923,28 +1120,18 @@ class BlockTransactionsRequest():
             self.indexes.append(deser_compact_size(f))
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.blockhash)
-        r += ser_compact_size(len(self.indexes))
-        for x in self.indexes:
-            r += ser_compact_size(x)
-        return r
+        return b"".join(chain(
+            (ser_uint256(self.blockhash), ser_compact_size(len(self.indexes))),
+            map(ser_compact_size, self.indexes)))
 
     # helper to set the differentially encoded indexes from absolute ones
     def from_absolute(self, absolute_indexes):
-        self.indexes = []
-        last_index = -1
-        for x in absolute_indexes:
-            self.indexes.append(x-last_index-1)
-            last_index = x
+        absolute_indexes = list(absolute_indexes)
+        self.indexes = [x - last_index - 1 for last_index, x in
+                        zip(chain((-1,), absolute_indexes), absolute_indexes)]
 
     def to_absolute(self):
-        absolute_indexes = []
-        last_index = -1
-        for x in self.indexes:
-            absolute_indexes.append(x+last_index+1)
-            last_index = absolute_indexes[-1]
-        return absolute_indexes
+        return [x - 1 for x in accumulate(x + 1 for x in self.indexes)]
 
     def __repr__(self):
         return "BlockTransactionsRequest(hash=%064x indexes=%s)" % (self.blockhash, repr(self.indexes))
@@ -961,18 +1148,32 @@ class BlockTransactions():
         self.transactions = deser_vector(f, CTransaction)
 
     def serialize(self, with_witness=True):
-        r = b""
-        r += ser_uint256(self.blockhash)
+        parts = []
+        parts.append(ser_uint256(self.blockhash))
         if with_witness:
-            r += ser_vector(self.transactions, "serialize_with_witness")
+            parts.append(ser_vector(self.transactions, "serialize_with_witness"))
         else:
-            r += ser_vector(self.transactions, "serialize_without_witness")
-        return r
+            parts.append(ser_vector(self.transactions, "serialize_without_witness"))
+        return b"".join(parts)
 
     def __repr__(self):
         return "BlockTransactions(hash=%064x transactions=%s)" % (self.blockhash, repr(self.transactions))
 
+# the bits of every byte value, least significant bit first, and the reverse
+# mapping used to pack groups of eight bits
+_BYTE_BITS = [tuple(b & (1 << i) != 0 for i in range(8)) for b in range(256)]
+_BITS_BYTE = {bits: b for b, bits in enumerate(_BYTE_BITS)}
+
+def _unpack_bits(data):
+    return list(chain.from_iterable(map(_BYTE_BITS.__getitem__, data)))
+
+def _pack_bits(bits):
+    it = chain(bits, repeat(False, -len(bits) % 8))
+    # zip over the same iterator eight times yields consecutive groups of eight
+    return bytes(map(_BITS_BYTE.__getitem__, zip(it, it, it, it, it, it, it, it)))
+
 class CPartialMerkleTree():
+    __slots__ = ("nTransactions", "vHash", "vBits", "fBad")
     def __init__(self):
         self.nTransactions = 0
         self.vHash = []
@@ -980,27 +1181,23 @@ class CPartialMerkleTree():
         self.fBad = False
 
     def deserialize(self, f):
-        self.nTransactions = struct.unpack("<i", f.read(4))[0]
+        self.nTransactions = _I32.unpack(f.read(4))[0]
         self.vHash = deser_uint256_vector(f)
         vBytes = deser_string(f)
-        self.vBits = []
-        for i in range(len(vBytes) * 8):
-            self.vBits.append(vBytes[i//8] & (1 << (i % 8)) != 0)
+        self.vBits = _unpack_bits(vBytes)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nTransactions)
-        r += ser_uint256_vector(self.vHash)
-        vBytesArray = bytearray([0x00] * ((len(self.vBits) + 7)//8))
-        for i in range(len(self.vBits)):
-            vBytesArray[i // 8] |= self.vBits[i] << (i % 8)
-        r += ser_string(bytes(vBytesArray))
-        return r
+        return b"".join((
+            _I32.pack(self.nTransactions),
+            ser_uint256_vector(self.vHash),
+            ser_string(_pack_bits(self.vBits)),
+        ))
 
     def __repr__(self):
         return "CPartialMerkleTree(nTransactions=%d, vHash=%s, vBits=%s)" % (self.nTransactions, repr(self.vHash), repr(self.vBits))
 
 class CMerkleBlock():
+    __slots__ = ("header", "txn")
     def __init__(self):
         self.header = CBlockHeader()
         self.txn = CPartialMerkleTree()
@@ -1010,10 +1207,10 @@ class CMerkleBlock():
         self.txn.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.header.serialize()
-        r += self.txn.serialize()
-        return r
+        return b"".join((
+            self.header.serialize(),
+            self.txn.serialize(),
+        ))
 
     def __repr__(self):
         return "CMerkleBlock(header=%s, txn=%s)" % (repr(self.header), repr(self.txn))
@@ -1022,6 +1219,7 @@ class CMerkleBlock():
 # Objects that correspond to messages on the wire
 class msg_version():
     command = b"version"
+    __slots__ = ("nVersion", "nServices", "nTime", "addrTo", "addrFrom", "nNonce", "strSubVer", "nStartingHeight", "nRelay")
 
     def __init__(self):
         self.nVersion = MY_VERSION
@@ -1035,18 +1233,16 @@ class msg_version():
         self.nRelay = MY_RELAY
 
     def deserialize(self, f):
-        self.nVersion = struct.unpack("<i", f.read(4))[0]
+        self.nVersion, self.nServices, self.nTime = _read_struct(f, _VERSION_HEAD)
         if self.nVersion == 10300:
             self.nVersion = 300
-        self.nServices = struct.unpack("<Q", f.read(8))[0]
-        self.nTime = struct.unpack("<q", f.read(8))[0]
         self.addrTo = CAddress()
         self.addrTo.deserialize(f)
 
         if self.nVersion >= 106:
             self.addrFrom = CAddress()
             self.addrFrom.deserialize(f)
-            self.nNonce = struct.unpack("<Q", f.read(8))[0]
+            self.nNonce = _U64.unpack(f.read(8))[0]
             self.strSubVer = deser_string(f)
         else:
             self.addrFrom = None
@@ -1055,31 +1251,29 @@ class msg_version():
             self.nStartingHeight = None
 
         if self.nVersion >= 209:
-            self.nStartingHeight = struct.unpack("<i", f.read(4))[0]
+            self.nStartingHeight = _I32.unpack(f.read(4))[0]
         else:
             self.nStartingHeight = None
 
         if self.nVersion >= 70001:
             # Relay field is optional for version 70001 onwards
             try:
-                self.nRelay = struct.unpack("<b", f.read(1))[0]
+                self.nRelay = _I8.unpack(f.read(1))[0]
             except:
                 self.nRelay = 0
         else:
             self.nRelay = 0
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<i", self.nVersion)
-        r += struct.pack("<Q", self.nServices)
-        r += struct.pack("<q", self.nTime)
-        r += self.addrTo.serialize()
-        r += self.addrFrom.serialize()
-        r += struct.pack("<Q", self.nNonce)
-        r += ser_string(self.strSubVer)
-        r += struct.pack("<i", self.nStartingHeight)
-        r += struct.pack("<b", self.nRelay)
-        return r
+        return b"".join((
+            _VERSION_HEAD.pack(self.nVersion, self.nServices, self.nTime),
+            self.addrTo.serialize(),
+            self.addrFrom.serialize(),
+            _U64.pack(self.nNonce),
+            ser_string(self.strSubVer),
+            _I32.pack(self.nStartingHeight),
+            _I8.pack(self.nRelay),
+        ))
 
     def __repr__(self):
         return 'msg_version(nVersion=%i nServices=%i nTime=%s addrTo=%s addrFrom=%s nNonce=0x%016X strSubVer=%s nStartingHeight=%i nRelay=%i)' \
@@ -1088,11 +1282,9 @@ class msg_version():
                self.strSubVer, self.nStartingHeight, self.nRelay)
 
 
-class msg_verack():
-    command = b"verack"
-
-    def __init__(self):
-        pass
+class _EmptyPayloadMsg():
+    """Base for messages that carry no payload."""
+    __slots__ = ()
 
     def deserialize(self, f):
         pass
@@ -1100,12 +1292,18 @@ class msg_verack():
     def serialize(self):
         return b""
 
+
+class msg_verack(_EmptyPayloadMsg):
+    command = b"verack"
+    __slots__ = ()
+
     def __repr__(self):
         return "msg_verack()"
 
 
 class msg_addr():
     command = b"addr"
+    __slots__ = ("addrs",)
 
     def __init__(self):
         self.addrs = []
@@ -1122,6 +1320,7 @@ class msg_addr():
 
 class msg_inv():
     command = b"inv"
+    __slots__ = ("inv",)
 
     def __init__(self, inv=None):
         if inv is None:
@@ -1141,6 +1340,7 @@ class msg_inv():
 
 class msg_getdata():
     command = b"getdata"
+    __slots__ = ("inv",)
 
     def __init__(self, inv=None):
         self.inv = inv if inv != None else []
@@ -1157,6 +1357,7 @@ class msg_getdata():
 
 class msg_getblocks():
     command = b"getblocks"
+    __slots__ = ("locator", "hashstop")
 
     def __init__(self):
         self.locator = CBlockLocator()
@@ -1168,10 +1369,10 @@ class msg_getblocks():
         self.hashstop = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+        return b"".join((
+            self.locator.serialize(),
+            ser_uint256(self.hashstop),
+        ))
 
     def __repr__(self):
         return "msg_getblocks(locator=%s hashstop=%064x)" \
@@ -1180,6 +1381,7 @@ class msg_getblocks():
 
 class msg_tx():
     command = b"tx"
+    __slots__ = ("tx",)
 
     def __init__(self, tx=CTransaction()):
         self.tx = tx
@@ -1194,6 +1396,7 @@ class msg_tx():
         return "msg_tx(tx=%s)" % (repr(self.tx))
 
 class msg_witness_tx(msg_tx):
+    __slots__ = ()
 
     def serialize(self):
         return self.tx.serialize_with_witness()
@@ -1201,6 +1404,7 @@ class msg_witness_tx(msg_tx):
 
 class msg_block():
     command = b"block"
+    __slots__ = ("block",)
 
     def __init__(self, block=None):
         if block is None:
@@ -1220,6 +1424,7 @@ class msg_block():
 # for cases where a user needs tighter control over what is sent over the wire
 # note that the user must supply the name of the command, and the data
 class msg_generic():
+    __slots__ = ("command", "data")
     def __init__(self, command, data=None):
         self.command = command
         self.data = data
@@ -1231,22 +1436,15 @@ class msg_generic():
         return "msg_generic()"
 
 class msg_witness_block(msg_block):
+    __slots__ = ()
 
     def serialize(self):
         r = self.block.serialize(with_witness=True)
         return r
 
-class msg_getaddr():
+class msg_getaddr(_EmptyPayloadMsg):
     command = b"getaddr"
-
-    def __init__(self):
-        pass
-
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
+    __slots__ = ()
 
     def __repr__(self):
         return "msg_getaddr()"
@@ -1254,17 +1452,16 @@ class msg_getaddr():
 
 class msg_ping():
     command = b"ping"
+    __slots__ = ("nonce",)
 
     def __init__(self, nonce=0):
         self.nonce = nonce
 
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = _U64.unpack(f.read(8))[0]
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nonce)
-        return r
+        return _U64.pack(self.nonce)
 
     def __repr__(self):
         return "msg_ping(nonce=%08x)" % self.nonce
@@ -1272,48 +1469,31 @@ class msg_ping():
 
 class msg_pong():
     command = b"pong"
+    __slots__ = ("nonce",)
 
     def __init__(self, nonce=0):
         self.nonce = nonce
 
     def deserialize(self, f):
-        self.nonce = struct.unpack("<Q", f.read(8))[0]
+        self.nonce = _U64.unpack(f.read(8))[0]
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.nonce)
-        return r
+        return _U64.pack(self.nonce)
 
     def __repr__(self):
         return "msg_pong(nonce=%08x)" % self.nonce
 
 
-class msg_mempool():
+class msg_mempool(_EmptyPayloadMsg):
     command = b"mempool"
-
-    def __init__(self):
-        pass
-
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
+    __slots__ = ()
 
     def __repr__(self):
         return "msg_mempool()"
 
-class msg_sendheaders():
+class msg_sendheaders(_EmptyPayloadMsg):
     command = b"sendheaders"
-
-    def __init__(self):
-        pass
-
-    def deserialize(self, f):
-        pass
-
-    def serialize(self):
-        return b""
+    __slots__ = ()
 
     def __repr__(self):
         return "msg_sendheaders()"
@@ -1325,6 +1505,7 @@ class msg_sendheaders():
 # hash_stop (hash of last desired block header, 0 to get as many as possible)
 class msg_getheaders():
     command = b"getheaders"
+    __slots__ = ("locator", "hashstop")
 
     def __init__(self):
         self.locator = CBlockLocator()
@@ -1336,10 +1517,10 @@ class msg_getheaders():
         self.hashstop = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        r += ser_uint256(self.hashstop)
-        return r
+        return b"".join((
+            self.locator.serialize(),
+            ser_uint256(self.hashstop),
+        ))
 
     def __repr__(self):
         return "msg_getheaders(locator=%s, stop=%064x)" \
@@ -1350,27 +1531,27 @@ class msg_getheaders():
 # <count> <vector of block headers>
 class msg_headers():
     command = b"headers"
+    __slots__ = ("headers",)
 
     def __init__(self, headers=None):
         self.headers = headers if headers is not None else []
 
     def deserialize(self, f):
-        blocks = deser_vector(f, CBlockHeader)
-        for x in blocks:
-            self.headers.append(x)
+        self.headers = deser_vector(f, CBlockHeader)
 
     def serialize(self):
-        headers_to_send = []
-        for header in self.headers:
-            headers_to_send.append(CBlockHeader(header))
-        return ser_vector(headers_to_send)
+        return ser_vector(self.headers, "serialize_header_only")
 
     def __repr__(self):
         return "msg_headers(headers=%s)" % repr(self.headers)
 
 
+# Reject messages for these commands carry the hash of the rejected object.
+_REJECT_DATA_MSGS = frozenset((b"block", b"tx"))
+
 class msg_reject():
     command = b"reject"
+    __slots__ = ("message", "code", "reason", "data")
     REJECT_MALFORMED = 1
 
     def __init__(self):
@@ -1379,22 +1560,24 @@ class msg_reject():
         self.reason = b""
         self.data = 0
 
+    def has_data(self):
+        return (self.code != self.REJECT_MALFORMED and
+                self.message in _REJECT_DATA_MSGS)
+
     def deserialize(self, f):
         self.message = deser_string(f)
-        self.code = struct.unpack("<B", f.read(1))[0]
+        self.code = _U8.unpack(f.read(1))[0]
         self.reason = deser_string(f)
-        if (self.code != self.REJECT_MALFORMED and
-                (self.message == b"block" or self.message == b"tx")):
+        if self.has_data():
             self.data = deser_uint256(f)
 
     def serialize(self):
-        r = ser_string(self.message)
-        r += struct.pack("<B", self.code)
-        r += ser_string(self.reason)
-        if (self.code != self.REJECT_MALFORMED and
-                (self.message == b"block" or self.message == b"tx")):
-            r += ser_uint256(self.data)
-        return r
+        parts = [ser_string(self.message)]
+        parts.append(_U8.pack(self.code))
+        parts.append(ser_string(self.reason))
+        if self.has_data():
+            parts.append(ser_uint256(self.data))
+        return b"".join(parts)
 
     def __repr__(self):
         return "msg_reject: %s %d %s [%064x]" \
@@ -1402,43 +1585,40 @@ class msg_reject():
 
 class msg_feefilter():
     command = b"feefilter"
+    __slots__ = ("feerate",)
 
     def __init__(self, feerate=0):
         self.feerate = feerate
 
     def deserialize(self, f):
-        self.feerate = struct.unpack("<Q", f.read(8))[0]
+        self.feerate = _U64.unpack(f.read(8))[0]
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<Q", self.feerate)
-        return r
+        return _U64.pack(self.feerate)
 
     def __repr__(self):
         return "msg_feefilter(feerate=%08x)" % self.feerate
 
 class msg_sendcmpct():
     command = b"sendcmpct"
+    __slots__ = ("announce", "version")
 
     def __init__(self):
         self.announce = False
         self.version = 1
 
     def deserialize(self, f):
-        self.announce = struct.unpack("<?", f.read(1))[0]
-        self.version = struct.unpack("<Q", f.read(8))[0]
+        self.announce, self.version = _read_struct(f, _SENDCMPCT)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<?", self.announce)
-        r += struct.pack("<Q", self.version)
-        return r
+        return _SENDCMPCT.pack(self.announce, self.version)
 
     def __repr__(self):
         return "msg_sendcmpct(announce=%s, version=%lu)" % (self.announce, self.version)
 
 class msg_cmpctblock():
     command = b"cmpctblock"
+    __slots__ = ("header_and_shortids",)
 
     def __init__(self, header_and_shortids = None):
         self.header_and_shortids = header_and_shortids
@@ -1448,15 +1628,14 @@ class msg_cmpctblock():
         self.header_and_shortids.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.header_and_shortids.serialize()
-        return r
+        return self.header_and_shortids.serialize()
 
     def __repr__(self):
         return "msg_cmpctblock(HeaderAndShortIDs=%s)" % repr(self.header_and_shortids)
 
 class msg_getblocktxn():
     command = b"getblocktxn"
+    __slots__ = ("block_txn_request",)
 
     def __init__(self):
         self.block_txn_request = None
@@ -1466,15 +1645,14 @@ class msg_getblocktxn():
         self.block_txn_request.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.block_txn_request.serialize()
-        return r
+        return self.block_txn_request.serialize()
 
     def __repr__(self):
         return "msg_getblocktxn(block_txn_request=%s)" % (repr(self.block_txn_request))
 
 class msg_blocktxn():
     command = b"blocktxn"
+    __slots__ = ("block_transactions",)
 
     def __init__(self):
         self.block_transactions = BlockTransactions()
@@ -1483,27 +1661,19 @@ class msg_blocktxn():
         self.block_transactions.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.block_transactions.serialize(with_witness=False)
-        return r
+        return self.block_transactions.serialize(with_witness=False)
 
     def __repr__(self):
         return "msg_blocktxn(block_transactions=%s)" % (repr(self.block_transactions))
 
 class msg_witness_blocktxn(msg_blocktxn):
+    __slots__ = ()
     def serialize(self):
-        r = b""
-        r += self.block_transactions.serialize(with_witness=True)
-        return r
+        return self.block_transactions.serialize(with_witness=True)
 
-class msg_getsnaphead:
+class msg_getsnaphead(_EmptyPayloadMsg):
     command = b"getsnaphead"
-
-    def serialize(self):
-        r = b""
-        return r
-
-    def deserialize(self, f): pass
+    __slots__ = ()
 
     def __repr__(self):
         return "msg_getsnaphead"
@@ -1511,6 +1681,7 @@ class msg_getsnaphead:
 
 class msg_snaphead:
     command = b"snaphead"
+    __slots__ = ("snapshot_header",)
 
     def __init__(self, snapshot_header=None):
         self.snapshot_header = SnapshotHeader() if snapshot_header is None else snapshot_header
@@ -1526,6 +1697,7 @@ class msg_snaphead:
 
 
 class SnapshotHeader:
+    __slots__ = ("snapshot_hash", "block_hash", "stake_modifier", "chain_work", "total_utxo_subsets")
     def __init__(self, snapshot_hash=0, block_hash=0, stake_modifier=0, chain_work=0, total_utxo_subsets=0):
         self.snapshot_hash = snapshot_hash
         self.block_hash = block_hash
@@ -1534,20 +1706,19 @@ class SnapshotHeader:
         self.total_utxo_subsets = total_utxo_subsets
 
     def deserialize(self, f):
-        self.snapshot_hash = deser_uint256(f)
-        self.block_hash = deser_uint256(f)
-        self.stake_modifier = deser_uint256(f)
-        self.chain_work = deser_uint256(f)
-        self.total_utxo_subsets = struct.unpack('<Q', f.read(8))[0]
+        (snapshot_hash, block_hash, stake_modifier, chain_work,
+         self.total_utxo_subsets) = _read_struct(f, _SNAPSHOT_HEADER)
+        self.snapshot_hash = uint256_from_str(snapshot_hash)
+        self.block_hash = uint256_from_str(block_hash)
+        self.stake_modifier = uint256_from_str(stake_modifier)
+        self.chain_work = uint256_from_str(chain_work)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.snapshot_hash)
-        r += ser_uint256(self.block_hash)
-        r += ser_uint256(self.stake_modifier)
-        r += ser_uint256(self.chain_work)
-        r += struct.pack('<Q', self.total_utxo_subsets)
-        return r
+        return _SNAPSHOT_HEADER.pack(ser_uint256(self.snapshot_hash),
+                                     ser_uint256(self.block_hash),
+                                     ser_uint256(self.stake_modifier),
+                                     ser_uint256(self.chain_work),
+                                     self.total_utxo_subsets)
 
     def __repr__(self):
         return "SnapshotHeader(snapshot_hash=%064x block_hash=%064x stake_modifier=%064x chain_work=%064x total_utxo_subsets=%i)" \
@@ -1556,6 +1727,7 @@ class SnapshotHeader:
 
 class msg_getsnapshot:
     command = b"getsnapshot"
+    __slots__ = ("getsnapshot",)
 
     def __init__(self, getsnapshot=None):
         self.getsnapshot = GetSnapshot() if getsnapshot is None else getsnapshot
@@ -1571,22 +1743,18 @@ class msg_getsnapshot:
 
 
 class GetSnapshot:
+    __slots__ = ("snapshot_hash", "utxo_subset_index", "utxo_subset_count")
     def __init__(self, snapshot_hash=0, index=0, count=0):
         self.snapshot_hash = snapshot_hash
         self.utxo_subset_index = index
         self.utxo_subset_count = count
 
     def deserialize(self, f):
-        self.snapshot_hash = deser_uint256(f)
-        self.utxo_subset_index = struct.unpack('<Q', f.read(8))[0]
-        self.utxo_subset_count = struct.unpack('<H', f.read(2))[0]
+        snapshot_hash, self.utxo_subset_index, self.utxo_subset_count = _read_struct(f, _GETSNAPSHOT)
+        self.snapshot_hash = uint256_from_str(snapshot_hash)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.snapshot_hash)
-        r += struct.pack('<Q', self.utxo_subset_index)
-        r += struct.pack('<H', self.utxo_subset_count)
-        return r
+        return _GETSNAPSHOT.pack(ser_uint256(self.snapshot_hash), self.utxo_subset_index, self.utxo_subset_count)
 
     def __repr__(self):
         return "GetSnapshot(snapshot_hash=%064x utxo_subset_index=%i utxo_subset_count=%i)" \
@@ -1595,6 +1763,7 @@ class GetSnapshot:
 
 class msg_snapshot:
     command = b"snapshot"
+    __slots__ = ("snapshot",)
 
     def __init__(self, snapshot=None):
         self.snapshot = Snapshot() if snapshot is None else snapshot
@@ -1610,22 +1779,27 @@ class msg_snapshot:
 
 
 class Snapshot:
-    def __init__(self, snapshot_hash=0, utxo_subset_index=0, utxo_subsets=[]):
+    __slots__ = ("snapshot_hash", "utxo_subset_index", "utxo_subsets")
+    def __init__(self, snapshot_hash=0, utxo_subset_index=0, utxo_subsets=None):
         self.snapshot_hash = snapshot_hash
         self.utxo_subset_index = utxo_subset_index
-        self.utxo_subsets = utxo_subsets
+        self.utxo_subsets = utxo_subsets if utxo_subsets is not None else []
 
     def deserialize(self, f):
-        self.snapshot_hash = deser_uint256(f)
-        self.utxo_subset_index = struct.unpack('<Q', f.read(8))[0]
-        self.utxo_subsets = deser_vector(f, UTXOSubset)
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        self.snapshot_hash, off = _read_uint256(buf, off)
+        self.utxo_subset_index = _U64.unpack_from(buf, off)[0]
+        self.utxo_subsets, off = _read_vector(buf, off + 8, UTXOSubset)
+        return off
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.snapshot_hash)
-        r += struct.pack('<Q', self.utxo_subset_index)
-        r += ser_vector(self.utxo_subsets)
-        return r
+        return b"".join((
+            ser_uint256(self.snapshot_hash),
+            _U64.pack(self.utxo_subset_index),
+            ser_vector(self.utxo_subsets),
+        ))
 
     def __repr__(self):
         return "Snapshot(snapshot_hash=%064x utxo_subset_index=%i, utxo_subsets=%s)" \
@@ -1633,6 +1807,7 @@ class Snapshot:
 
 
 class UTXOSubset:
+    __slots__ = ("tx_id", "height", "tx_type", "outputs")
     def __init__(self):
         self.tx_id = 0
         self.height = 0
@@ -1640,18 +1815,20 @@ class UTXOSubset:
         self.outputs = dict()
 
     def deserialize(self, f):
-        self.tx_id = deser_uint256(f)
-        self.height = struct.unpack('<I', f.read(4))[0]
-        self.tx_type = TxType(struct.unpack('<B', f.read(1))[0])
-        self.outputs = deser_uint32_map(f, CTxOut)
+        _deserialize_stream(self, f)
+
+    def deserialize_from(self, buf, off):
+        tx_id, self.height, tx_type = _UTXO_SUBSET_HEAD.unpack_from(buf, off)
+        self.tx_id = uint256_from_str(tx_id)
+        self.tx_type = TxType(tx_type)
+        self.outputs, off = _read_uint32_map(buf, off + _UTXO_SUBSET_HEAD.size, CTxOut)
+        return off
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.tx_id)
-        r += struct.pack('<I', self.height)
-        r += struct.pack('<B', self.tx_type.value)
-        r += ser_uint32_map(self.outputs)
-        return r
+        return b"".join((
+            _UTXO_SUBSET_HEAD.pack(ser_uint256(self.tx_id), self.height, self.tx_type.value),
+            ser_uint32_map(self.outputs),
+        ))
 
     def __repr__(self):
         return "UTXOSubset(tx_id=%064x height=%i, tx_type=%s outputs=%s)" \
@@ -1660,6 +1837,7 @@ class UTXOSubset:
 
 class msg_notfound():
     command = b"notfound"
+    __slots__ = ("inv",)
 
     def __init__(self, inv=None):
         self.inv = inv if inv != None else []
@@ -1675,8 +1853,9 @@ class msg_notfound():
 
 
 class CommitsLocator():
-    def __init__(self, start=[], stop=0):
-        self.start = start
+    __slots__ = ("start", "stop")
+    def __init__(self, start=None, stop=0):
+        self.start = start if start is not None else []
         self.stop = stop
 
     def deserialize(self, f):
@@ -1684,10 +1863,10 @@ class CommitsLocator():
         self.stop = deser_uint256(f)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256_vector(self.start)
-        r += ser_uint256(self.stop)
-        return r
+        return b"".join((
+            ser_uint256_vector(self.start),
+            ser_uint256(self.stop),
+        ))
 
     def __repr__(self):
         return "CommitsLocator(start=%s stop=%064x)" \
@@ -1696,6 +1875,7 @@ class CommitsLocator():
 
 class msg_getcommits:
     command = b"getcommits"
+    __slots__ = ("locator",)
 
     def __init__(self, locator=None):
         if locator is None:
@@ -1707,14 +1887,13 @@ class msg_getcommits:
         self.locator.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.locator.serialize()
-        return r
+        return self.locator.serialize()
 
     def __repr__(self):
         return "getcommits(%s)" % (repr(self.locator))
 
 class HeaderAndCommits:
+    __slots__ = ("header", "commits")
     def __init__(self, header=None):
         self.header = header if header is not None else CBlockHeader()
         self.commits = []
@@ -1725,13 +1904,14 @@ class HeaderAndCommits:
         self.commits = deser_vector(f, CTransaction)
 
     def serialize(self):
-        r = b""
-        r += self.header.serialize()
-        r += ser_vector(self.commits, "serialize_without_witness")
-        return r
+        return b"".join((
+            self.header.serialize(),
+            ser_vector(self.commits, "serialize_without_witness"),
+        ))
 
 class msg_commits:
     command = b"commits"
+    __slots__ = ("status", "data")
 
     def __init__(self, status=0):
         self.status = status
@@ -1742,17 +1922,18 @@ class msg_commits:
             self.status, len(self.data), self.data[0].header.hash if len(self.data) > 0 else "Nil")
 
     def deserialize(self, f):
-        self.status = struct.unpack("<B", f.read(1))[0]
+        self.status = _U8.unpack(f.read(1))[0]
         self.data = deser_vector(f, HeaderAndCommits)
 
     def serialize(self):
-        r = b""
-        r += struct.pack("<B", self.status)
-        r += ser_vector(self.data)
-        return r
+        return b"".join((
+            _U8.pack(self.status),
+            ser_vector(self.data),
+        ))
 
 
 class GrapheneBlockRequest:
+    __slots__ = ("requested_block_hash", "requester_mempool_count")
     def __init__(self, requested_block_hash=None, requester_mempool_count=0):
         self.requested_block_hash = requested_block_hash
         self.requester_mempool_count = requester_mempool_count
@@ -1762,10 +1943,10 @@ class GrapheneBlockRequest:
         self.requester_mempool_count = deser_uint64(f)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.requested_block_hash)
-        r += ser_uint64(self.requester_mempool_count)
-        return r
+        return b"".join((
+            ser_uint256(self.requested_block_hash),
+            ser_uint64(self.requester_mempool_count),
+        ))
 
     def __repr__(self):
         return "GrapheneBlockRequest(hash=%064x mempool=%d)" % (self.requested_block_hash, self.requester_mempool_count)
@@ -1773,6 +1954,7 @@ class GrapheneBlockRequest:
 
 class msg_getgraphene:
     command = b'getgraphene'
+    __slots__ = ("request",)
 
     def __init__(self, request=None):
         if request is None:
@@ -1784,15 +1966,14 @@ class msg_getgraphene:
         self.request.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.request.serialize()
-        return r
+        return self.request.serialize()
 
     def __repr__(self):
         return "msg_getgraphene(request=%s)" % (repr(self.request))
 
 
 class CBloomFilterDummy:
+    __slots__ = ("vData", "nHashFuncs", "nTweak", "nFlags")
     def __init__(self):
         self.vData = b"ffff"
         self.nHashFuncs = 1
@@ -1801,36 +1982,31 @@ class CBloomFilterDummy:
 
     def deserialize(self, f):
         self.vData = deser_string(f)
-        self.nHashFuncs = struct.unpack("<I", f.read(4))[0]
-        self.nTweak = struct.unpack("<I", f.read(4))[0]
-        self.nFlags = struct.unpack("<B", f.read(1))[0]
+        self.nHashFuncs, self.nTweak, self.nFlags = _read_struct(f, _BLOOM_FILTER_TAIL)
 
     def serialize(self):
-        r = b""
-        r += ser_string(self.vData)
-        r += struct.pack("<I", self.nHashFuncs & 0xFFFFFFFF)
-        r += struct.pack("<I", self.nTweak & 0xFFFFFFFF)
-        r += struct.pack("<B", self.nFlags & 0xFF)
-
-        return r
+        return b"".join((
+            ser_string(self.vData),
+            _BLOOM_FILTER_TAIL.pack(self.nHashFuncs & 0xFFFFFFFF, self.nTweak & 0xFFFFFFFF, self.nFlags & 0xFF),
+        ))
 
     def __repr__(self):
         return "CBloomFilterDummy"
 
 
 class GrapheneIbltEntryDummy:
+    __slots__ = ("count", "key_sum", "key_check")
     def __init__(self):
         self.count = 0
         self.key_sum = 0
         self.key_check = 0
 
     def serialize(self):
-        r = b""
-        r += ser_compact_size(self.count)
-        r += ser_uint64(self.key_sum)
-        r += ser_uint32(self.key_check)
-
-        return r
+        return b"".join((
+            ser_compact_size(self.count),
+            ser_uint64(self.key_sum),
+            ser_uint32(self.key_check),
+        ))
 
     def deserialize(self, f):
         self.count = deser_compact_size(f)
@@ -1841,25 +2017,27 @@ class GrapheneIbltEntryDummy:
 # Can serialize/deserialize IBLT as is,
 # but does not contain IBLT computation logic
 class GrapheneIbltDummy:
+    __slots__ = ("hash_table", "num_hashes")
     def __init__(self):
         self.hash_table = []
         self.num_hashes = 1
 
     def deserialize(self, f):
         self.hash_table = deser_vector(f, GrapheneIbltEntryDummy)
-        self.num_hashes = struct.unpack("<B", f.read(1))[0]
+        self.num_hashes = _U8.unpack(f.read(1))[0]
 
     def serialize(self):
-        r = b""
-        r += ser_vector(self.hash_table)
-        r += struct.pack("<B", self.num_hashes & 0xFF)
-        return r
+        return b"".join((
+            ser_vector(self.hash_table),
+            _U8.pack(self.num_hashes & 0xFF),
+        ))
 
     def __repr__(self):
         return "GrapheneIbltDummy"
 
 
 class GrapheneBlock:
+    __slots__ = ("header", "nonce", "bloom_filter", "iblt", "prefilled_transactions")
     def __init__(self):
         self.header = CBlockHeader()
         self.nonce = 0
@@ -1875,14 +2053,13 @@ class GrapheneBlock:
         self.prefilled_transactions = deser_vector(f, CTransaction)
 
     def serialize(self):
-        r = b""
-        r += self.header.serialize()
-        r += ser_uint64(self.nonce)
-        r += self.bloom_filter.serialize()
-        r += self.iblt.serialize()
-        r += ser_vector(self.prefilled_transactions)
-
-        return r
+        return b"".join((
+            self.header.serialize(),
+            ser_uint64(self.nonce),
+            self.bloom_filter.serialize(),
+            self.iblt.serialize(),
+            ser_vector(self.prefilled_transactions),
+        ))
 
     def __repr__(self):
         return "GrapheneBlock(header=%s, nonce=%s, bloom_filter=%s, iblt=%s, prefilled_transactions=%s)" % \
@@ -1891,6 +2068,7 @@ class GrapheneBlock:
 
 class msg_graphenblock:
     command = b'graphenblock'
+    __slots__ = ("block",)
 
     def __init__(self, block=None):
         if block is None:
@@ -1902,33 +2080,30 @@ class msg_graphenblock:
         self.block.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.block.serialize()
-        return r
+        return self.block.serialize()
 
     def __repr__(self):
         return "msg_graphenblock(block=%s)" % repr(self.block)
 
 
 class GrapheneTxRequest:
+    __slots__ = ("block_hash", "missing_tx_short_hashes")
     def __init__(self):
         self.block_hash = None
         self.missing_tx_short_hashes = []
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.block_hash)
-        r += ser_compact_size(len(self.missing_tx_short_hashes))
-        for hash in self.missing_tx_short_hashes:
-            r += ser_uint64(hash)
-
-        return r
+        n = len(self.missing_tx_short_hashes)
+        return b"".join((
+            ser_uint256(self.block_hash),
+            ser_compact_size(n),
+            struct.pack("<%dQ" % n, *(h & 0xFFFFFFFFFFFFFFFF for h in self.missing_tx_short_hashes)),
+        ))
 
     def deserialize(self, f):
         self.block_hash = deser_uint256(f)
-        self.missing_tx_short_hashes.clear()
-        for _ in range(deser_compact_size(f)):
-            self.missing_tx_short_hashes.append(deser_uint64(f))
+        n = deser_compact_size(f)
+        self.missing_tx_short_hashes[:] = struct.unpack("<%dQ" % n, f.read(8 * n))
 
     def __repr__(self):
         return "GrapheneTxRequest(block_hash=%064x missing_tx_short_hashes=%s)" %\
@@ -1937,14 +2112,13 @@ class GrapheneTxRequest:
 
 class msg_getgraphentx:
     command = b"getgraphentx"
+    __slots__ = ("request",)
 
     def __init__(self):
         self.request = GrapheneTxRequest()
 
     def serialize(self):
-        r = "b"
-        r += self.request.serialize()
-        return r
+        return self.request.serialize()
 
     def deserialize(self, f):
         self.request.deserialize(f)
@@ -1954,6 +2128,7 @@ class msg_getgraphentx:
 
 
 class GrapheneTx:
+    __slots__ = ("block_hash", "txs")
     def __init__(self, block_hash=None, txs=None):
         if block_hash is None:
             self.block_hash = None
@@ -1970,10 +2145,10 @@ class GrapheneTx:
         self.txs = deser_vector(f, CTransaction)
 
     def serialize(self):
-        r = b""
-        r += ser_uint256(self.block_hash)
-        r += ser_vector(self.txs, "serialize_with_witness")
-        return r
+        return b"".join((
+            ser_uint256(self.block_hash),
+            ser_vector(self.txs, "serialize_with_witness"),
+        ))
 
     def __repr__(self):
         return "GrapheneTx(hash=%064x transactions=%s)" % (self.block_hash, repr(self.txs))
@@ -1981,6 +2156,7 @@ class GrapheneTx:
 
 class msg_graphenetx:
     command = b"graphenetx"
+    __slots__ = ("graphene_tx",)
 
     def __init__(self, graphene_tx=None):
         if graphene_tx is None:
@@ -1992,9 +2168,7 @@ class msg_graphenetx:
         self.graphene_tx.deserialize(f)
 
     def serialize(self):
-        r = b""
-        r += self.graphene_tx.serialize()
-        return r
+        return self.graphene_tx.serialize()
 
     def __repr__(self):
         return "msg_graphenetx(graphene_tx=%s)" % repr(self.graphene_tx)
@@ -66,6 +66,9 @@ MAGIC_BYTES = {
     "regtest": b"\xfa\xbf\xb5\xda",   # regtest
 }
 
+# magic, zero padded command, payload length, checksum
+MSG_HEADER = struct.Struct("<4s12sI4s")
+
 class P2PConnection(asyncore.dispatcher):
     """A low-level connection object to a node's P2P interface.
 
@@ -218,14 +221,8 @@ class P2PConnection(asyncore.dispatcher):
     def send_data(self, command, data, pushbuf=False):
         if self.state != "connected" and not pushbuf:
             raise IOError('Not connected, no pushbuf')
-        tmsg = MAGIC_BYTES[self.network]
-        tmsg += command
-        tmsg += b"\x00" * (12 - len(command))
-        tmsg += struct.pack("<I", len(data))
-        th = sha256(data)
-        h = sha256(th)
-        tmsg += h[:4]
-        tmsg += data
+        h = sha256(sha256(data))
+        tmsg = MSG_HEADER.pack(MAGIC_BYTES[self.network], command, len(data), h[:4]) + data
         with mininode_lock:
             if (len(self.sendbuf) == 0 and not pushbuf):
                 try: